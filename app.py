@@ -1,27 +1,61 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response, ORJSONResponse
 import uvicorn
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 import logging
 import asyncio
-from datetime import datetime
+from datetime import datetime, timedelta
+from decimal import Decimal
 import json
+import time
+import hashlib
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+import orjson
 
 from database import DatabaseManager, QueryValidator, SecurityError
-from utils import AIQueryGenerator, ChatHistoryManager, ResponseFormatter
+from utils import (
+    AIQueryGenerator, ChatHistoryManager, ResponseFormatter,
+    TTLCache, QueryCoalescer, schema_fingerprint, query_cache_key
+)
 from config import get_settings
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def _orjson_default(obj: Any) -> Any:
+    """Serialize database values that orjson does not support natively"""
+    if isinstance(obj, Decimal):
+        # Same as FastAPI's decimal_encoder: integral values stay ints
+        if obj.as_tuple().exponent >= 0:
+            return int(obj)
+        return float(obj)
+    if isinstance(obj, timedelta):
+        return obj.total_seconds()
+    if isinstance(obj, (bytes, memoryview)):
+        return bytes(obj).decode("utf-8", errors="replace")
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+class ChatbotJSONResponse(ORJSONResponse):
+    """orjson response that also handles NUMERIC, INTERVAL and BYTEA values"""
+    
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(
+            content,
+            default=_orjson_default,
+            option=orjson.OPT_NON_STR_KEYS
+        )
+
 app = FastAPI(
     title="AI PostgreSQL Chatbot",
     description="An intelligent chatbot for querying PostgreSQL databases using natural language",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ChatbotJSONResponse
 )
 
 # Configure CORS
@@ -33,10 +67,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Global variables
-db_manager = None
-ai_generator = None
-chat_history = None
+# Compress larger responses; tabular JSON repeats column names per row
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
+# Cached database metadata as (fetched_at, metadata, schema_hash)
+_metadata_cache: Optional[Tuple[float, Dict[str, Any], bytes]] = None
+# Serializes refills so concurrent requests share a single metadata fetch
+_metadata_lock = asyncio.Lock()
 
 # Pydantic models
 class ChatMessage(BaseModel):
@@ -67,34 +104,160 @@ class QueryResponse(BaseModel):
     execution_time: Optional[float] = None
 
 # Dependency injection
+# Each service is built lazily by a cached factory, so it is created once per process
+@lru_cache(maxsize=1)
+def _db_manager() -> DatabaseManager:
+    settings = get_settings()
+    return DatabaseManager(
+        host=settings.db_host,
+        port=settings.db_port,
+        database=settings.db_name,
+        username=settings.db_user,
+        password=settings.db_password
+    )
+
+@lru_cache(maxsize=1)
+def _ai_generator() -> AIQueryGenerator:
+    settings = get_settings()
+    return AIQueryGenerator(
+        api_key=settings.openai_api_key,
+        model=settings.openai_model
+    )
+
+@lru_cache(maxsize=1)
+def _chat_history() -> ChatHistoryManager:
+    settings = get_settings()
+    return ChatHistoryManager(
+        max_history_per_session=settings.history_max_turns
+    )
+
+@lru_cache(maxsize=1)
+def _query_cache() -> TTLCache:
+    settings = get_settings()
+    return TTLCache(
+        max_size=settings.cache_max_size,
+        ttl=settings.cache_ttl
+    )
+
+@lru_cache(maxsize=1)
+def _result_cache() -> TTLCache:
+    settings = get_settings()
+    return TTLCache(
+        max_size=settings.cache_max_size,
+        ttl=settings.result_cache_ttl
+    )
+
+@lru_cache(maxsize=1)
+def _query_coalescer() -> QueryCoalescer:
+    return QueryCoalescer()
+
+@lru_cache(maxsize=1)
+def _db_executor() -> ThreadPoolExecutor:
+    # Caps concurrent blocking DB calls within this worker process; it is
+    # not tied to the psycopg2 pool, which is sized separately
+    settings = get_settings()
+    return ThreadPoolExecutor(
+        max_workers=settings.db_pool_size,
+        thread_name_prefix="pg"
+    )
+
+async def run_db(func, *args):
+    """Run a blocking database call on the database thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor(), func, *args)
+
 async def get_db_manager():
-    global db_manager
-    if db_manager is None:
-        settings = get_settings()
-        db_manager = DatabaseManager(
-            host=settings.db_host,
-            port=settings.db_port,
-            database=settings.db_name,
-            username=settings.db_user,
-            password=settings.db_password
-        )
-    return db_manager
+    return _db_manager()
 
 async def get_ai_generator():
-    global ai_generator
-    if ai_generator is None:
-        settings = get_settings()
-        ai_generator = AIQueryGenerator(
-            api_key=settings.openai_api_key,
-            model=settings.openai_model
-        )
-    return ai_generator
+    return _ai_generator()
 
 async def get_chat_history():
-    global chat_history
-    if chat_history is None:
-        chat_history = ChatHistoryManager()
-    return chat_history
+    return _chat_history()
+
+async def get_query_cache():
+    return _query_cache()
+
+async def get_query_coalescer():
+    return _query_coalescer()
+
+async def get_cached_metadata(db: DatabaseManager) -> Tuple[Dict[str, Any], bytes]:
+    """Get database metadata and its schema hash, re-fetching only once older than cache_ttl"""
+    global _metadata_cache
+    settings = get_settings()
+    if not settings.enable_cache:
+        metadata = await run_db(db.get_database_metadata)
+        return metadata, schema_fingerprint(metadata)
+    
+    def is_fresh() -> bool:
+        return (
+            _metadata_cache is not None
+            and time.monotonic() - _metadata_cache[0] <= settings.cache_ttl
+        )
+    
+    if not is_fresh():
+        async with _metadata_lock:
+            # Another request may have refilled the cache while this one waited
+            if not is_fresh():
+                metadata = await run_db(db.get_database_metadata)
+                _metadata_cache = (time.monotonic(), metadata, schema_fingerprint(metadata))
+    return _metadata_cache[1], _metadata_cache[2]
+
+async def execute_cached_select(db: DatabaseManager, query: str) -> List[Dict]:
+    """Run a SELECT capped at max_result_rows, reusing rows of an identical recent query"""
+    settings = get_settings()
+    if not settings.enable_cache:
+        results = await run_db(db.execute_select, query)
+        return results[:settings.max_result_rows]
+    
+    # Keyed on the exact query text; whitespace inside literals is significant
+    cache = _result_cache()
+    key = query.strip()
+    results = cache.get(key)
+    if results is None:
+        results = await run_db(db.execute_select, query)
+        # Only capped rows are kept, so cached entries stay bounded
+        results = results[:settings.max_result_rows]
+        cache.set(key, results)
+    return results
+
+def invalidate_metadata_cache():
+    """Drop the cached database metadata so the next request re-reads the schema"""
+    global _metadata_cache
+    _metadata_cache = None
+
+async def _init_db():
+    """Create the database manager and verify the connection"""
+    db = await get_db_manager()
+    if not await run_db(db.test_connection):
+        raise Exception("Failed to connect to database")
+    
+    # Report healthy right away instead of waiting for the first probe
+    app.state.db_healthy = True
+    app.state.db_health_error = None
+    app.state.db_health_checked_at = time.monotonic()
+    return db
+
+async def _init_ai():
+    """Create and initialize the AI generator"""
+    ai = await get_ai_generator()
+    await ai.initialize()
+    return ai
+
+async def _health_pinger():
+    """Periodically refresh the cached database health status read by /health"""
+    settings = get_settings()
+    db = await get_db_manager()
+    while True:
+        try:
+            app.state.db_healthy = await run_db(db.test_connection)
+            app.state.db_health_error = None
+        except Exception as e:
+            logger.warning(f"Database health check failed: {e}")
+            app.state.db_healthy = False
+            app.state.db_health_error = str(e)
+        app.state.db_health_checked_at = time.monotonic()
+        await asyncio.sleep(settings.health_check_interval)
 
 # Startup event
 @app.on_event("startup")
@@ -103,17 +266,12 @@ async def startup_event():
     try:
         logger.info("Starting AI PostgreSQL Chatbot...")
         
-        # Initialize database manager
-        db = await get_db_manager()
-        if not db.test_connection():
-            raise Exception("Failed to connect to database")
+        # Database, AI generator and chat history are independent, so
+        # bring them up concurrently
+        await asyncio.gather(_init_db(), _init_ai(), get_chat_history())
         
-        # Initialize AI generator
-        ai = await get_ai_generator()
-        await ai.initialize()
-        
-        # Initialize chat history
-        await get_chat_history()
+        # Probe the database in the background so /health never waits on it
+        app.state.health_task = asyncio.create_task(_health_pinger())
         
         logger.info("All services initialized successfully")
         
@@ -125,15 +283,18 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on shutdown"""
-    if db_manager:
-        db_manager.close_all_connections()
+    health_task = getattr(app.state, "health_task", None)
+    if health_task:
+        health_task.cancel()
+    if _db_executor.cache_info().currsize:
+        _db_executor().shutdown(wait=True)
+    if _db_manager.cache_info().currsize:
+        _db_manager().close_all_connections()
     logger.info("AI PostgreSQL Chatbot shutdown complete")
 
 # Routes
-@app.get("/", response_class=HTMLResponse)
-async def root():
-    """Serve the main chat interface"""
-    html_content = """
+# Main chat interface, encoded once at import time
+_ROOT_HTML = """
     <!DOCTYPE html>
     <html>
     <head>
@@ -269,26 +430,51 @@ async def root():
     </body>
     </html>
     """
-    return HTMLResponse(content=html_content)
+_ROOT_HTML_BYTES = _ROOT_HTML.encode("utf-8")
+_ROOT_HTML_ETAG = f'"{hashlib.md5(_ROOT_HTML_BYTES).hexdigest()}"'
+_ROOT_HTML_HEADERS = {"Cache-Control": "public, max-age=3600", "ETag": _ROOT_HTML_ETAG}
+
+@app.get("/", response_class=HTMLResponse)
+async def root(request: Request):
+    """Serve the main chat interface"""
+    if_none_match = request.headers.get("if-none-match", "")
+    if _ROOT_HTML_ETAG in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=_ROOT_HTML_HEADERS)
+    return HTMLResponse(content=_ROOT_HTML_BYTES, headers=_ROOT_HTML_HEADERS)
 
 @app.post("/chat", response_model=ChatResponse)
 async def chat(
     message: ChatMessage,
     db: DatabaseManager = Depends(get_db_manager),
     ai: AIQueryGenerator = Depends(get_ai_generator),
-    history: ChatHistoryManager = Depends(get_chat_history)
+    history: ChatHistoryManager = Depends(get_chat_history),
+    query_cache: TTLCache = Depends(get_query_cache),
+    coalescer: QueryCoalescer = Depends(get_query_coalescer)
 ):
     """Main chat endpoint for natural language queries"""
     try:
         # Get database metadata for context
-        metadata = db.get_database_metadata()
+        metadata, schema_hash = await get_cached_metadata(db)
+        chat_context = history.get_history(message.session_id)
         
-        # Generate SQL query from natural language
-        query_result = await ai.generate_query(
-            user_message=message.message,
-            database_metadata=metadata,
-            chat_history=history.get_history(message.session_id)
-        )
+        # Reuse the query generated for the same question, schema and history
+        use_cache = get_settings().enable_cache
+        cache_key = query_cache_key(message.message, schema_hash, chat_context)
+        query_result = query_cache.get(cache_key) if use_cache else None
+        
+        if query_result is None:
+            # Generate SQL query from natural language; identical requests
+            # arriving while this one is in flight share its LLM call
+            query_result = await coalescer.run(
+                cache_key,
+                lambda: ai.generate_query(
+                    user_message=message.message,
+                    database_metadata=metadata,
+                    chat_history=chat_context
+                )
+            )
+            if use_cache and query_result.get("query"):
+                query_cache.set(cache_key, query_result)
         
         response_data = {
             "response": query_result["explanation"],
@@ -308,7 +494,7 @@ async def chat(
                 response_data["error"] = f"Query validation failed: {reason}"
             else:
                 try:
-                    results = db.execute_select(query_result["query"])
+                    results = await execute_cached_select(db, query_result["query"])
                     response_data["results"] = results
                     
                     # Format results for better presentation
@@ -318,10 +504,10 @@ async def chat(
                             query_result["explanation"], 
                             results
                         )
-else:
+                    else:
                         response_data["response"] += "\n\nNo results found."
                         
-except Exception as e:
+                except Exception as e:
                     response_data["error"] = f"Query execution failed: {str(e)}"
         
         # Add to chat history
@@ -333,9 +519,10 @@ except Exception as e:
             results=response_data.get("results")
         )
         
-        return ChatResponse(**response_data)
+        # Server-built data, so skip re-validating it through ChatResponse
+        return ChatbotJSONResponse(response_data)
         
-except Exception as e:
+    except Exception as e:
         logger.error(f"Chat error: {e}")
         return ChatResponse(
             response=f"I encountered an error while processing your request: {str(e)}",
@@ -348,8 +535,8 @@ except Exception as e:
 async def get_database_info(db: DatabaseManager = Depends(get_db_manager)):
     """Get database schema information"""
     try:
-        metadata = db.get_database_metadata()
-        connection_status = db.test_connection()
+        metadata, _ = await get_cached_metadata(db)
+        connection_status = await run_db(db.test_connection)
         
         return DatabaseInfo(
             tables=metadata["tables"],
@@ -360,6 +547,12 @@ async def get_database_info(db: DatabaseManager = Depends(get_db_manager)):
         logger.error(f"Database info error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/database/refresh")
+async def refresh_database_info():
+    """Clear the cached database schema information"""
+    invalidate_metadata_cache()
+    return {"message": "Database metadata cache cleared"}
+
 @app.post("/query/execute", response_model=QueryResponse)
 async def execute_direct_query(
     request: QueryRequest,
@@ -379,20 +572,22 @@ async def execute_direct_query(
         if request.validate_only:
             return QueryResponse(is_safe=True)
         
-        # Execute query
-        import time
+        # Execute query; direct queries bypass the result cache so the
+        # reported execution_time always reflects a real database run
         start_time = time.time()
         
-        results = db.execute_select(request.query)
+        results = await run_db(db.execute_select, request.query)
         execution_time = time.time() - start_time
+        results = results[:get_settings().max_result_rows]
         
-        return QueryResponse(
-            results=results,
-            is_safe=True,
-            execution_time=execution_time
-        )
+        return ChatbotJSONResponse({
+            "results": results,
+            "error": None,
+            "is_safe": True,
+            "execution_time": execution_time
+        })
         
-except Exception as e:
+    except Exception as e:
         logger.error(f"Query execution error: {e}")
         return QueryResponse(
             error=str(e),
@@ -401,22 +596,31 @@ except Exception as e:
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
-    try:
-        db = await get_db_manager()
-        db_status = db.test_connection()
-        
-        return {
-            "status": "healthy" if db_status else "unhealthy",
-            "database_connected": db_status,
-            "timestamp": datetime.now()
-        }
-    except Exception as e:
-        return {
-            "status": "unhealthy",
-            "error": str(e),
-            "timestamp": datetime.now()
-        }
+    """Health check endpoint, reporting the last background database probe"""
+    settings = get_settings()
+    db_status = getattr(app.state, "db_healthy", False)
+    checked_at = getattr(app.state, "db_health_checked_at", None)
+    # A hung probe never updates db_healthy, so treat an old result as unknown
+    probe_age = time.monotonic() - checked_at if checked_at is not None else None
+    stale = probe_age is None or probe_age > settings.health_check_interval * 3
+    if stale:
+        db_status = False
+    health = {
+        "status": "healthy" if db_status else "unhealthy",
+        "database_connected": db_status,
+        "timestamp": datetime.now()
+    }
+    
+    if probe_age is not None:
+        health["last_check_age_seconds"] = round(probe_age, 3)
+    
+    error = getattr(app.state, "db_health_error", None)
+    if stale:
+        health["error"] = "Database health probe is stale"
+    elif error:
+        health["error"] = error
+    
+    return health
 
 @app.get("/chat/history/{session_id}")
 async def get_chat_history_endpoint(
@@ -6,12 +6,37 @@ and environment variables for security.
 """
 
 import os
-from typing import Optional, List
+import re
+from functools import lru_cache
+from typing import Optional, List, Pattern, Tuple
 from pathlib import Path
-from pydantic import BaseSettings, validator, Field
+from pydantic import BaseSettings, validator, root_validator, Field
 from pydantic.types import SecretStr
 
 
+@lru_cache(maxsize=8)
+def _compile_keyword_pattern(keywords: Tuple[str, ...]) -> Pattern[str]:
+    """
+    Compile blocked keywords into a single case-insensitive regex.
+    
+    Word boundaries are only required on the sides of a keyword that start
+    or end with a word character, so punctuation keywords such as "--"
+    still match anywhere.
+    
+    Args:
+        keywords: Keywords to match
+        
+    Returns:
+        Compiled alternation pattern
+    """
+    alternatives = []
+    for keyword in keywords:
+        prefix = r"(?<!\w)" if re.match(r"\w", keyword[0]) else ""
+        suffix = r"(?!\w)" if re.match(r"\w", keyword[-1]) else ""
+        alternatives.append(f"{prefix}{re.escape(keyword)}{suffix}")
+    return re.compile("(" + "|".join(alternatives) + ")", re.IGNORECASE)
+
+
 class Settings(BaseSettings):
     """
     Application settings with automatic environment variable loading.
@@ -32,6 +57,8 @@ class Settings(BaseSettings):
     db_pool_size: int = Field(default=10, ge=1, le=50, description="Connection pool size")
     db_pool_overflow: int = Field(default=20, ge=0, le=100, description="Connection pool overflow")
     db_pool_timeout: int = Field(default=30, ge=1, le=300, description="Connection timeout in seconds")
+    db_use_pgbouncer: bool = Field(default=False, description="Connect through PgBouncer transaction pooling")
+    health_check_interval: int = Field(default=5, ge=1, le=300, description="Database health probe interval in seconds")
     
     # AI/LLM Configuration
     openai_api_key: Optional[SecretStr] = Field(default=None, description="OpenAI API key")
@@ -68,6 +95,10 @@ class Settings(BaseSettings):
     enable_cache: bool = Field(default=True, description="Enable query result caching")
     cache_ttl: int = Field(default=300, ge=0, le=3600, description="Cache TTL in seconds")
     cache_max_size: int = Field(default=100, ge=1, le=1000, description="Maximum cache entries")
+    result_cache_ttl: int = Field(default=30, ge=0, le=3600, description="Query result cache TTL in seconds")
+    
+    # Chat History Settings
+    history_max_turns: int = Field(default=20, ge=1, le=500, description="Chat turns kept per session")
     
     # Rate Limiting
     rate_limit_requests: int = Field(default=60, ge=1, le=1000, description="Requests per minute")
@@ -114,6 +145,17 @@ class Settings(BaseSettings):
             raise ValueError("At least one schema must be allowed")
         return v
     
+    @root_validator(skip_on_failure=True)
+    def apply_pgbouncer_defaults(cls, values):
+        """Point at PgBouncer and shrink the app-side pool when it is enabled."""
+        if values.get("db_use_pgbouncer"):
+            if values.get("db_port") == 5432:
+                values["db_port"] = 6432
+            # Bounds the database thread pool in app.py; DatabaseManager
+            # does not take a pool size yet, so its own pool is unchanged
+            values["db_pool_size"] = min(values["db_pool_size"], 2)
+        return values
+    
     def get_database_url(self, async_driver: bool = False) -> str:
         """
         Generate database connection URL.
@@ -161,11 +203,13 @@ class Settings(BaseSettings):
         if len(query) > self.max_query_length:
             return False, f"Query too long (max {self.max_query_length} characters)"
         
-        # Check for blocked keywords
-        query_upper = query.upper()
-        for keyword in self.blocked_keywords:
-            if keyword in query_upper:
-                return False, f"Blocked keyword detected: {keyword}"
+        # Check for blocked keywords in a single pass over the query
+        keywords = tuple(keyword for keyword in self.blocked_keywords if keyword)
+        if keywords:
+            pattern = _compile_keyword_pattern(keywords)
+            match = pattern.search(query)
+            if match:
+                return False, f"Blocked keyword detected: {match.group(1).upper()}"
         
         return True, "Query allowed"
     
@@ -212,10 +256,24 @@ def load_settings(config_file: Optional[str] = None) -> Settings:
         
         return settings
         
-except Exception as e:
+    except Exception as e:
         raise RuntimeError(f"Failed to load configuration: {e}")
 
 
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """
+    Get the application settings, loading them on first use.
+    
+    The environment and .env file are parsed once per process; later calls
+    return the same Settings instance.
+    
+    Returns:
+        Cached Settings instance
+    """
+    return load_settings()
+
+
 def create_sample_env_file(file_path: str = ".env.sample") -> None:
     """
     Create a sample .env file with all configuration options.
@@ -238,6 +296,8 @@ CHATBOT_DB_SCHEMA=public
 CHATBOT_DB_POOL_SIZE=10
 CHATBOT_DB_POOL_OVERFLOW=20
 CHATBOT_DB_POOL_TIMEOUT=30
+CHATBOT_DB_USE_PGBOUNCER=false
+CHATBOT_HEALTH_CHECK_INTERVAL=5
 
 # AI/LLM Configuration
 CHATBOT_OPENAI_API_KEY=your_openai_api_key_here
@@ -268,8 +328,10 @@ CHATBOT_WEB_TITLE=AI PostgreSQL Chatbot
 # Performance Settings
 CHATBOT_ENABLE_CACHE=true
 CHATBOT_CACHE_TTL=300
+CHATBOT_RESULT_CACHE_TTL=30
 CHATBOT_QUERY_TIMEOUT=30
 CHATBOT_MAX_RESULT_ROWS=1000
+CHATBOT_HISTORY_MAX_TURNS=20
 
 # Rate Limiting
 CHATBOT_RATE_LIMIT_REQUESTS=60
@@ -294,6 +356,6 @@ if __name__ == "__main__":
         print(f"Database: {settings.db_host}:{settings.db_port}/{settings.db_name}")
         print(f"OpenAI Model: {settings.openai_model}")
         print(f"Debug Mode: {settings.debug_mode}")
-except Exception as e:
+    except Exception as e:
         print(f"❌ Configuration error: {e}")
         print("💡 Make sure to create a .env file with your settings.")
@@ -0,0 +1,20 @@
+"""
+Gunicorn configuration for serving the chatbot API in production.
+
+Usage:
+    gunicorn app:app -c gunicorn.conf.py
+
+Workers run UvicornWorker from the uvicorn-worker package, which uses uvloop
+and httptools when they are installed (uvicorn[standard]). The app is
+preloaded in the master process so module-level constants are shared
+copy-on-write between workers; database pools and other services are still
+created per worker at startup.
+"""
+
+import multiprocessing
+import os
+
+bind = os.environ.get("CHATBOT_API_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("CHATBOT_API_WORKERS", multiprocessing.cpu_count()))
+worker_class = "uvicorn_worker.UvicornWorker"
+preload_app = True
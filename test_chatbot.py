@@ -1,31 +1,54 @@
 import pytest
+import pytest_asyncio
 import asyncio
+import time
 from unittest.mock import Mock, patch, AsyncMock
-from fastapi.testclient import TestClient
+from types import SimpleNamespace as NS
+import httpx
 import json
+from decimal import Decimal
 
-from app import app
+import app as app_module
+from app import app, _orjson_default
 from database import DatabaseManager, QueryValidator
-from utils import AIQueryGenerator, ChatHistoryManager, ResponseFormatter
-from config import TestingSettings
+from utils import (
+    AIQueryGenerator, ChatHistoryManager, ChatMessage, ResponseFormatter,
+    TTLCache, QueryCoalescer, query_cache_key
+)
+from config import Settings, TestingSettings
+
+def _mk_resp(content):
+    """Build a minimal ChatCompletion-shaped response"""
+    return NS(choices=[NS(message=NS(content=content))])
+
+# Shared read-only fixtures
+@pytest.fixture(scope="module")
+def db_manager():
+    """Create a test database manager"""
+    return DatabaseManager(
+        host="localhost",
+        port=5432,
+        database="test_db",
+        username="test_user",
+        password="test_pass"
+    )
+
+@pytest.fixture(scope="module")
+def ai_generator():
+    """Create a test AI query generator"""
+    return AIQueryGenerator(api_key="test_key", model="gpt-3.5-turbo")
 
 # Test client
-client = TestClient(app)
+@pytest_asyncio.fixture
+async def client():
+    """In-process async client for the FastAPI app"""
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+        yield ac
 
 class TestDatabaseManager:
     """Test database manager functionality"""
     
-    @pytest.fixture
-    def db_manager(self):
-        """Create a test database manager"""
-        return DatabaseManager(
-            host="localhost",
-            port=5432,
-            database="test_db",
-            username="test_user",
-            password="test_pass"
-        )
-    
     def test_connection_initialization(self, db_manager):
         """Test database connection initialization"""
         assert db_manager.host == "localhost"
@@ -70,11 +93,6 @@ class TestDatabaseManager:
 class TestAIQueryGenerator:
     """Test AI query generator functionality"""
     
-    @pytest.fixture
-    def ai_generator(self):
-        """Create a test AI query generator"""
-        return AIQueryGenerator(api_key="test_key", model="gpt-3.5-turbo")
-    
     def test_initialization(self, ai_generator):
         """Test AI generator initialization"""
         assert ai_generator.api_key == "test_key"
@@ -117,14 +135,11 @@ class TestAIQueryGenerator:
     @pytest.mark.asyncio
     async def test_query_generation_success(self, mock_openai, ai_generator):
         """Test successful query generation"""
-        mock_response = Mock()
-        mock_response.choices = [Mock()]
-        mock_response.choices[0].message.content = json.dumps({
+        mock_openai.return_value = _mk_resp(json.dumps({
             "query": "SELECT * FROM users LIMIT 10;",
             "explanation": "This query retrieves all users from the database.",
             "confidence": "high"
-        })
-        mock_openai.return_value = mock_response
+        }))
         
         metadata = {"tables": {}, "relationships": []}
         result = await ai_generator.generate_query("Show me all users", metadata)
@@ -137,10 +152,7 @@ class TestAIQueryGenerator:
     @pytest.mark.asyncio
     async def test_query_generation_invalid_json(self, mock_openai, ai_generator):
         """Test query generation with invalid JSON response"""
-        mock_response = Mock()
-        mock_response.choices = [Mock()]
-        mock_response.choices[0].message.content = "This is not valid JSON"
-        mock_openai.return_value = mock_response
+        mock_openai.return_value = _mk_resp("This is not valid JSON")
         
         metadata = {"tables": {}, "relationships": []}
         result = await ai_generator.generate_query("Show me all users", metadata)
@@ -194,3 +206,238 @@ class TestChatHistoryManager:
         
         history = chat_manager.get_history("test_session")
         assert len(history) == 0
+
+class TestChatMessage:
+    """Test the chat message record"""
+    
+    def test_to_dict(self):
+        """Test conversion to a plain dict"""
+        message = ChatMessage(
+            session_id="test_session",
+            user_message="Hello",
+            bot_response="Hi there!",
+            query="SELECT 1",
+            results_count=1
+        )
+        
+        data = message.to_dict()
+        assert data["user_message"] == "Hello"
+        assert data["bot_response"] == "Hi there!"
+        assert data["query"] == "SELECT 1"
+        assert data["results_count"] == 1
+        assert isinstance(message.timestamp, int)
+        assert data["timestamp"].endswith("+00:00")
+    
+    def test_immutable(self):
+        """Test that messages cannot be modified after creation"""
+        message = ChatMessage(session_id="s", user_message="Hello", bot_response="Hi")
+        with pytest.raises(AttributeError):
+            message.user_message = "Changed"
+
+class TestTTLCache:
+    """Test the in-memory TTL cache"""
+    
+    def test_get_and_set(self):
+        """Test storing and retrieving values"""
+        cache = TTLCache(max_size=2, ttl=60)
+        cache.set("a", 1)
+        assert cache.get("a") == 1
+        assert cache.get("missing") is None
+    
+    def test_lru_eviction(self):
+        """Test that the least recently used entry is evicted first"""
+        cache = TTLCache(max_size=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+        assert len(cache) == 2
+    
+    def test_expiry(self):
+        """Test that expired entries are not returned"""
+        cache = TTLCache(max_size=2, ttl=0)
+        cache.set("a", 1)
+        assert cache.get("a") is None
+
+class TestQueryCacheKey:
+    """Test cache keys for generated queries"""
+    
+    def test_normalization(self):
+        """Test that whitespace and case do not change the cache key"""
+        assert query_cache_key("Show  me users", b"hash") == query_cache_key("show me users ", b"hash")
+        assert query_cache_key("Show me users", b"hash") != query_cache_key("Show me users", b"other")
+    
+    def test_history_turns(self):
+        """Test that only the conversation turns affect the key, not record metadata"""
+        first = [ChatMessage(session_id="a", user_message="What tables?", bot_response="users").to_dict()]
+        second = [ChatMessage(session_id="b", user_message="What tables?", bot_response="users").to_dict()]
+        other = [ChatMessage(session_id="a", user_message="What views?", bot_response="none").to_dict()]
+        
+        assert query_cache_key("Show me users", b"hash", first) == query_cache_key("Show me users", b"hash", second)
+        assert query_cache_key("Show me users", b"hash", first) != query_cache_key("Show me users", b"hash", other)
+        assert query_cache_key("Show me users", b"hash", first) != query_cache_key("Show me users", b"hash")
+
+class TestQueryCoalescer:
+    """Test coalescing of concurrent identical requests"""
+    
+    @pytest.mark.asyncio
+    async def test_concurrent_calls_share_result(self):
+        """Test that concurrent calls with the same key run the factory once"""
+        coalescer = QueryCoalescer()
+        calls = 0
+        
+        async def generate():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return {"query": "SELECT 1;"}
+        
+        results = await asyncio.gather(*[coalescer.run("key", generate) for _ in range(5)])
+        
+        assert calls == 1
+        assert all(result == {"query": "SELECT 1;"} for result in results)
+        assert len(coalescer) == 0
+
+class TestSettings:
+    """Test settings-based query validation"""
+    
+    @pytest.fixture
+    def settings(self):
+        """Create test settings"""
+        return Settings(db_name="test_db", db_user="test_user", db_password="test_pass")
+    
+    def test_query_allowed(self, settings):
+        """Test that plain SELECT queries are allowed"""
+        is_allowed, reason = settings.is_query_allowed("SELECT * FROM users")
+        assert is_allowed
+        assert reason == "Query allowed"
+    
+    def test_blocked_keyword(self, settings):
+        """Test that blocked keywords are detected case-insensitively"""
+        is_allowed, reason = settings.is_query_allowed("select 1; drop table users")
+        assert not is_allowed
+        assert reason == "Blocked keyword detected: DROP"
+    
+    def test_blocked_keyword_inside_identifier(self, settings):
+        """Test that blocked keywords only match whole words"""
+        is_allowed, _ = settings.is_query_allowed("SELECT created_at, updated_by FROM users")
+        assert is_allowed
+    
+    def test_blocked_punctuation_keyword(self):
+        """Test that keywords made of punctuation still match anywhere"""
+        settings = Settings(
+            db_name="test_db", db_user="test_user", db_password="test_pass",
+            blocked_keywords=["--", ";", "DROP"]
+        )
+        
+        is_allowed, reason = settings.is_query_allowed("SELECT 1 -- comment")
+        assert not is_allowed
+        assert reason == "Blocked keyword detected: --"
+        
+        is_allowed, reason = settings.is_query_allowed("SELECT 1; SELECT 2")
+        assert not is_allowed
+        assert reason == "Blocked keyword detected: ;"
+        
+        is_allowed, _ = settings.is_query_allowed("SELECT dropped_at FROM users")
+        assert is_allowed
+
+class TestResponseEncoding:
+    """Test JSON encoding of database values"""
+    
+    def test_decimal_encoding(self):
+        """Test that integral decimals stay ints, like FastAPI's decimal_encoder"""
+        assert _orjson_default(Decimal("5")) == 5
+        assert isinstance(_orjson_default(Decimal("5")), int)
+        assert _orjson_default(Decimal("5.50")) == 5.5
+
+class TestMetadataCache:
+    """Test the cached database metadata"""
+    
+    @pytest.mark.asyncio
+    async def test_concurrent_refill_fetches_once(self):
+        """Test that concurrent requests on a cold cache share one metadata fetch"""
+        db = Mock()
+        db.get_database_metadata.return_value = {"tables": {}, "relationships": []}
+        
+        async def fake_run_db(func, *args):
+            await asyncio.sleep(0.01)
+            return func(*args)
+        
+        settings = NS(enable_cache=True, cache_ttl=300)
+        app_module.invalidate_metadata_cache()
+        try:
+            with patch('app.get_settings', return_value=settings), \
+                 patch('app.run_db', side_effect=fake_run_db):
+                results = await asyncio.gather(
+                    *[app_module.get_cached_metadata(db) for _ in range(4)]
+                )
+            
+            db.get_database_metadata.assert_called_once()
+            assert all(result == results[0] for result in results)
+        finally:
+            app_module.invalidate_metadata_cache()
+
+class TestHealthCheck:
+    """Test the health check endpoint"""
+    
+    @pytest.mark.asyncio
+    async def test_health_reads_cached_status(self, client):
+        """Test that /health reports the last probe result without a database call"""
+        app.state.db_healthy = True
+        app.state.db_health_error = None
+        app.state.db_health_checked_at = time.monotonic()
+        try:
+            with patch('app.get_settings', return_value=NS(health_check_interval=5)), \
+                 patch('app.run_db', new_callable=AsyncMock) as mock_run_db:
+                response = await client.get("/health")
+            
+            assert response.status_code == 200
+            assert response.json()["status"] == "healthy"
+            assert response.json()["database_connected"] is True
+            mock_run_db.assert_not_called()
+        finally:
+            del app.state.db_healthy
+            del app.state.db_health_error
+            del app.state.db_health_checked_at
+    
+    @pytest.mark.asyncio
+    async def test_health_stale_probe_unhealthy(self, client):
+        """Test that a probe older than a few check intervals is reported unhealthy"""
+        app.state.db_healthy = True
+        app.state.db_health_error = None
+        app.state.db_health_checked_at = time.monotonic() - 3600
+        try:
+            with patch('app.get_settings', return_value=NS(health_check_interval=5)):
+                response = await client.get("/health")
+            
+            assert response.status_code == 200
+            assert response.json()["status"] == "unhealthy"
+            assert response.json()["database_connected"] is False
+            assert response.json()["last_check_age_seconds"] >= 3600
+        finally:
+            del app.state.db_healthy
+            del app.state.db_health_error
+            del app.state.db_health_checked_at
+
+class TestWebInterface:
+    """Test the web chat interface endpoint"""
+    
+    @pytest.mark.asyncio
+    async def test_root_serves_chat_interface(self, client):
+        """Test that the chat page is served with caching headers"""
+        response = await client.get("/")
+        assert response.status_code == 200
+        assert "AI PostgreSQL Chatbot" in response.text
+        assert response.headers["etag"]
+        assert response.headers["cache-control"] == "public, max-age=3600"
+    
+    @pytest.mark.asyncio
+    async def test_root_not_modified(self, client):
+        """Test that a matching ETag returns 304"""
+        etag = (await client.get("/")).headers["etag"]
+        response = await client.get("/", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
@@ -2,16 +2,125 @@ import openai
 import asyncio
 import json
 import logging
-from typing import Dict, List, Any, Optional, Tuple
-from datetime import datetime, timedelta
+from typing import Dict, List, Any, Optional, Tuple, Callable, Awaitable
+from datetime import datetime, timedelta, timezone
 import re
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, field
 import hashlib
 import time
+import orjson
+from collections import OrderedDict
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class ChatMessage:
     """Represents a single chat message"""
+    session_id: str
+    user_message: str
+    bot_response: str
+    query: Optional[str] = None
+    results_count: int = 0
+    timestamp: int = field(default_factory=time.time_ns)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to a plain dict without the deep copy done by asdict"""
+        # Timestamps are kept as epoch nanoseconds and only formatted here
+        return {
+            "session_id": self.session_id,
+            "user_message": self.user_message,
+            "bot_response": self.bot_response,
+            "query": self.query,
+            "results_count": self.results_count,
+            "timestamp": datetime.fromtimestamp(
+                self.timestamp / 1e9, tz=timezone.utc
+            ).isoformat()
+        }
+
+class TTLCache:
+    """Bounded in-memory LRU cache whose entries expire after a fixed TTL"""
+    
+    def __init__(self, max_size: int = 100, ttl: float = 300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+    
+    def get(self, key: Any) -> Optional[Any]:
+        """Return the cached value, or None if it is missing or expired"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        
+        expires_at, value = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            return None
+        
+        self._entries.move_to_end(key)
+        return value
+    
+    def set(self, key: Any, value: Any):
+        """Store a value, evicting the least recently used entries when full"""
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+    
+    def clear(self):
+        """Remove all entries"""
+        self._entries.clear()
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class QueryCoalescer:
+    """Collapses concurrent identical requests into a single in-flight call"""
+    
+    def __init__(self):
+        self._inflight: Dict[Any, asyncio.Future] = {}
+    
+    async def run(self, key: Any, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Await the call already running for key, or start one with factory.
+        
+        Args:
+            key: Identity of the request
+            factory: Creates the coroutine to run when nothing is in flight
+            
+        Returns:
+            Result of the shared call
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        
+        # Shield so one cancelled caller does not cancel the call for the others
+        return await asyncio.shield(task)
+    
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+def schema_fingerprint(metadata: Dict[str, Any]) -> bytes:
+    """Stable digest of the database metadata, used to key schema-dependent caches"""
+    payload = orjson.dumps(metadata, default=str, option=orjson.OPT_SORT_KEYS)
+    return hashlib.blake2b(payload, digest_size=16).digest()
+
+def query_cache_key(user_message: str, schema_hash: bytes, 
+                    chat_history: Optional[List[Dict]] = None) -> bytes:
+    """Build the cache key for a generated query from the normalized question, schema and history"""
+    normalized = " ".join(user_message.lower().split())
+    # Only the turns the prompt is built from; timestamps and session ids
+    # would make every key with history unique
+    turns = [
+        (turn.get("user_message"), turn.get("bot_response"))
+        for turn in chat_history or []
+    ]
+    history = orjson.dumps(turns)
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (normalized.encode("utf-8"), schema_hash, history):
+        digest.update(len(part).to_bytes(8, "little"))
+        digest.update(part)
+    return digest.digest()